@@ -1,147 +1,591 @@
 #!/usr/bin/env python3
 
 import argparse
+import errno
 import hashlib
 import json
+import mmap
 import os
+import shlex
 import shutil
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Iterable, Iterator, Optional, List, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+HASH_ALGORITHMS = ('sha1', 'blake3', 'xxh3')
+
+DEFAULT_SAMPLE_SIZE = 64 * 1024  # 64KB
+MAX_SAMPLE_SIZE = 1024 * 1024  # 1MB
+
+
+def default_hash_algorithm() -> str:
+    """Return the preferred hash algorithm available on this system"""
+    return 'blake3' if blake3 is not None else 'sha1'
+
+
+def new_hasher(algorithm: str, multithreaded: bool = False):
+    """Create a hash object for the given algorithm"""
+    if algorithm == 'sha1':
+        return hashlib.sha1()
+    elif algorithm == 'blake3':
+        if blake3 is None:
+            raise ValueError("blake3 algorithm requested but the blake3 package is not installed")
+        if multithreaded:
+            return blake3.blake3(max_threads=blake3.blake3.AUTO)
+        return blake3.blake3()
+    elif algorithm == 'xxh3':
+        if xxhash is None:
+            raise ValueError("xxh3 algorithm requested but the xxhash package is not installed")
+        return xxhash.xxh3_128()
+    else:
+        raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+
+def _sha_extensions_available() -> Optional[bool]:
+    """Detect CPU SHA instruction support; None if undetectable on this platform"""
+    try:
+        if sys.platform.startswith('linux'):
+            with open('/proc/cpuinfo') as f:
+                cpuinfo = f.read()
+            if 'flags' in cpuinfo:
+                return ' sha_ni' in cpuinfo
+            if 'Features' in cpuinfo:  # ARM
+                return ' sha1' in cpuinfo
+        elif sys.platform == 'darwin':
+            import subprocess
+            out = subprocess.run(['sysctl', '-n', 'hw.optional.arm.FEAT_SHA1'],
+                                 capture_output=True, text=True)
+            if out.returncode == 0:
+                return out.stdout.strip() == '1'
+    except OSError:
+        pass
+    return None
+
+
+def warn_if_sha1_unaccelerated(algorithm: str) -> None:
+    """Warn when SHA-1 hashing will run without hardware acceleration"""
+    if algorithm != 'sha1':
+        return
+    if _sha_extensions_available() is False:
+        print("Warning: CPU lacks SHA instruction support; SHA-1 hashing will use "
+              "the slower scalar path. Consider --hash blake3 or xxh3.", file=sys.stderr)
 
 
 class FileRecord:
-    def __init__(self, folder: str, filename: str, size: int, sample_sha1: Optional[str] = None, full_sha1: Optional[str] = None):
-        self.folder = folder
+    __slots__ = ('folder', 'filename', 'size', 'sample_hash', 'full_hash', '_full_path')
+
+    def __init__(self, folder: str, filename: str, size: int, sample_hash: Optional[str] = None, full_hash: Optional[str] = None):
+        # Folders repeat across records; interning stores each distinct
+        # folder string once and makes their comparisons pointer checks
+        self.folder = sys.intern(folder)
         self.filename = filename
         self.size = size
-        self.sample_sha1 = sample_sha1
-        self.full_sha1 = full_sha1
-    
+        self.sample_hash = sample_hash
+        self.full_hash = full_hash
+        # Precomputed once: classify/command generation read this O(N) times
+        self._full_path = f"{folder}/{filename}" if folder else filename
+
     def to_dict(self, level: int) -> Dict[str, Any]:
         result = {"folder": self.folder, "filename": self.filename, "size": self.size}
-        if level >= 2 and self.sample_sha1:
-            result["sample_sha1"] = self.sample_sha1
-        if level >= 3 and self.full_sha1:
-            result["full_sha1"] = self.full_sha1
+        if level >= 2 and self.sample_hash:
+            result["sample_hash"] = self.sample_hash
+        if level >= 3 and self.full_hash:
+            result["full_hash"] = self.full_hash
         return result
-    
-    def get_identity_key(self, level: int) -> Tuple:
-        """Return identity key for file matching based on level"""
-        if level == 1:
-            return (self.filename, self.size)
-        elif level == 2:
-            return (self.filename, self.size, self.sample_sha1)
-        elif level == 3:
-            return (self.filename, self.size, self.full_sha1)
-        else:
-            raise ValueError(f"Invalid level: {level}")
-    
+
     def get_full_path(self) -> str:
         """Return full path combining folder and filename"""
-        if self.folder:
-            return f"{self.folder}/{self.filename}"
-        return self.filename
+        return self._full_path
 
 
-def calculate_sample_sha1(file_path: Path) -> str:
-    """Calculate SHA-1 of first and last 64KB of file"""
-    sha1 = hashlib.sha1()
-    chunk_size = 64 * 1024  # 64KB
-    
-    with open(file_path, 'rb') as f:
+def _open_for_hashing(file_path: str, sequential: bool):
+    """Open a file read-only with kernel access-pattern hints
+
+    O_NOATIME skips the inode atime write per file where permitted;
+    fadvise widens readahead for sequential full-file reads and turns it
+    off for the seek-heavy sample reads.
+    """
+    flags = os.O_RDONLY | getattr(os, 'O_NOATIME', 0)
+    try:
+        fd = os.open(file_path, flags)
+    except PermissionError:
+        # O_NOATIME is only allowed for the file owner; retry without it
+        fd = os.open(file_path, os.O_RDONLY)
+    if hasattr(os, 'posix_fadvise'):
+        advice = os.POSIX_FADV_SEQUENTIAL if sequential else os.POSIX_FADV_RANDOM
+        os.posix_fadvise(fd, 0, 0, advice)
+    return os.fdopen(fd, 'rb')
+
+
+def calculate_sample_hash(file_path: str, algorithm: str = 'sha1',
+                          sample_size: int = DEFAULT_SAMPLE_SIZE,
+                          file_size: Optional[int] = None) -> str:
+    """Calculate hash of the head, middle and tail samples of a file
+
+    The file size is hashed as an 8-byte prefix so files of different
+    sizes can never produce the same sample hash. The middle sample is
+    only taken when the file is large enough that the three windows
+    cannot overlap.
+    """
+    hasher = new_hasher(algorithm)
+    if file_size is None:
+        file_size = os.stat(file_path).st_size
+    hasher.update(file_size.to_bytes(8, 'little'))
+
+    with _open_for_hashing(file_path, sequential=False) as f:
         # Read first chunk
-        first_chunk = f.read(chunk_size)
-        sha1.update(first_chunk)
-        
-        # If file is larger than 64KB, also read last chunk
-        file_size = file_path.stat().st_size
-        if file_size > chunk_size:
-            f.seek(-chunk_size, 2)  # Seek to 64KB from end
-            last_chunk = f.read(chunk_size)
-            sha1.update(last_chunk)
-    
-    return sha1.hexdigest()
+        first_chunk = f.read(sample_size)
+        hasher.update(first_chunk)
 
+        if file_size <= 2 * sample_size:
+            # Head and tail windows would overlap; hash the remaining
+            # bytes sequentially instead of seeking back and hashing the
+            # middle of the file twice
+            if file_size > sample_size:
+                hasher.update(f.read())
+        else:
+            # Middle sample for large files, aligned down to 4KB; the
+            # clamp keeps the aligned offset clear of the head window
+            # when sample_size is smaller than the alignment unit
+            if file_size > 4 * sample_size:
+                f.seek(max((file_size // 2) & ~0xFFF, sample_size))
+                hasher.update(f.read(sample_size))
 
-def calculate_full_sha1(file_path: Path) -> str:
-    """Calculate full SHA-1 checksum of file"""
-    sha1 = hashlib.sha1()
-    
-    with open(file_path, 'rb') as f:
-        while chunk := f.read(8192):
-            sha1.update(chunk)
-    
-    return sha1.hexdigest()
+            # Last chunk; absolute seek from the start of the file
+            f.seek(file_size - sample_size)
+            hasher.update(f.read(sample_size))
 
+    return hasher.hexdigest()
+
+
+def _drop_page_cache(fd: int) -> None:
+    """Tell the kernel we will not re-read these pages
+
+    A full-tree hash pass would otherwise evict every other working set
+    from the page cache for data this tool reads exactly once.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+# Below this size the mmap setup cost outweighs the saved read syscalls
+MMAP_THRESHOLD = 4 * 1024 * 1024
 
-def scan_directory(source_dir: Path, level: int, verbose: bool) -> list[FileRecord]:
-    """Scan directory and return list of FileRecord objects"""
-    records = []
-    
-    if verbose:
-        print(f"Scanning {source_dir} with level {level} identification...")
-    
-    for root, dirs, files in os.walk(source_dir):
-        for file in files:
-            file_path = Path(root) / file
-            relative_path = file_path.relative_to(source_dir)
-            
-            try:
-                size = file_path.stat().st_size
-                sample_sha1 = None
-                full_sha1 = None
-                
-                if level >= 2:
-                    sample_sha1 = calculate_sample_sha1(file_path)
-                    if verbose:
-                        print(f"  Sample hash: {relative_path}")
-                
-                if level >= 3:
-                    full_sha1 = calculate_full_sha1(file_path)
-                    if verbose:
-                        print(f"  Full hash: {relative_path}")
-                
-                folder_path = str(relative_path.parent) if relative_path.parent != Path('.') else ""
-                records.append(FileRecord(folder_path, file, size, sample_sha1, full_sha1))
-                
-            except (OSError, IOError) as e:
-                print(f"Error processing {relative_path}: {e}", file=sys.stderr)
-    
-    return records
 
+def calculate_full_hash(file_path: str, algorithm: str = 'sha1',
+                        file_size: Optional[int] = None) -> str:
+    """Calculate full-file checksum"""
+    if file_size is None:
+        file_size = os.stat(file_path).st_size
 
-def load_inventory(inventory_file: Path) -> List[FileRecord]:
-    """Load inventory from JSONL file"""
-    records = []
+    with _open_for_hashing(file_path, sequential=True) as f:
+        if file_size >= MMAP_THRESHOLD:
+            # Hand the whole file to the hasher as one buffer: no read
+            # syscalls, no Python chunk loop, kernel readahead drives I/O
+            hasher = new_hasher(algorithm, multithreaded=True)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                hasher.update(mm)
+            _drop_page_cache(f.fileno())
+            return hasher.hexdigest()
+
+        if hasattr(hashlib, 'file_digest'):
+            # file_digest runs the read/update loop in C and releases the GIL
+            digest = hashlib.file_digest(f, lambda: new_hasher(algorithm, multithreaded=True))
+            _drop_page_cache(f.fileno())
+            return digest.hexdigest()
+
+        # Pre-3.11 fallback: readinto a fixed buffer so each 1 MiB chunk
+        # reuses the same allocation instead of creating a bytes object
+        hasher = new_hasher(algorithm, multithreaded=True)
+        buf = bytearray(1024 * 1024)
+        view = memoryview(buf)
+        while n := f.readinto(buf):
+            hasher.update(view[:n])
+        _drop_page_cache(f.fileno())
+        return hasher.hexdigest()
+
+
+CACHE_FILENAME = '.dir-mimic-cache.jsonl'
+
+
+def _load_hash_cache(cache_file: str, algorithm: str,
+                     sample_size: int) -> Tuple[Dict[Tuple, Tuple], List[Tuple]]:
+    """Load the sidecar hash cache, returning (cache, foreign_entries)
+
+    Keys are (st_dev, st_ino, st_mtime_ns, st_size) tuples; any change to
+    a file bumps its mtime and invalidates the entry naturally. Entries
+    recorded under a different hash algorithm or sample size are returned
+    separately as (key, raw_entry) pairs so a rewrite can carry them
+    forward instead of wiping the cache on every settings switch.
+    """
+    cache: Dict[Tuple, Tuple] = {}
+    foreign: List[Tuple] = []
+    loads = json.loads if orjson is None else orjson.loads
     try:
-        with open(inventory_file, 'r') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
+        with open(cache_file, 'rb') as f:
+            for line in f:
+                if not line.strip():
                     continue
                 try:
-                    data = json.loads(line)
-                    record = FileRecord(
-                        folder=data.get("folder", ""),
-                        filename=data["filename"],
-                        size=data["size"],
-                        sample_sha1=data.get("sample_sha1"),
-                        full_sha1=data.get("full_sha1")
-                    )
-                    records.append(record)
-                except (json.JSONDecodeError, KeyError) as e:
-                    print(f"Error parsing line {line_num} in inventory: {e}", file=sys.stderr)
+                    entry = loads(line)
+                    key = (entry["dev"], entry["ino"], entry["mtime_ns"], entry["size"])
+                    if entry.get("hash") != algorithm or entry.get("sample_size") != sample_size:
+                        foreign.append((key, entry))
+                        continue
+                    cache[key] = (entry.get("sample_hash"), entry.get("full_hash"))
+                except (ValueError, KeyError):
                     continue
+    except FileNotFoundError:
+        pass
+    except IOError as e:
+        print(f"Warning: could not read hash cache {cache_file}: {e}", file=sys.stderr)
+    return cache, foreign
+
+
+def _write_hash_cache(cache_file: str, cache: Dict[Tuple, Tuple], algorithm: str,
+                      sample_size: int, seen: set, foreign: List[Tuple]) -> None:
+    """Rewrite the sidecar hash cache with the entries seen by this scan
+
+    Only keys whose stat signature was encountered during the walk are
+    written, so entries for deleted or renamed files fall out instead of
+    accumulating forever. Foreign-setting entries survive on the same
+    terms.
+    """
+    try:
+        f, serialize = _open_inventory_writer(cache_file)
+        with f:
+            for key, (sample_hash, full_hash) in cache.items():
+                if key not in seen:
+                    continue
+                dev, ino, mtime_ns, size = key
+                entry = {"dev": dev, "ino": ino, "mtime_ns": mtime_ns, "size": size,
+                         "hash": algorithm, "sample_size": sample_size}
+                if sample_hash:
+                    entry["sample_hash"] = sample_hash
+                if full_hash:
+                    entry["full_hash"] = full_hash
+                f.write(serialize(entry))
+            for key, entry in foreign:
+                if key in seen:
+                    f.write(serialize(entry))
+    except IOError as e:
+        print(f"Warning: could not write hash cache {cache_file}: {e}", file=sys.stderr)
+
+
+def _scan_one_dir(dir_path: str, folder: str):
+    """Scan a single directory, returning (file_tuples, subdir_tuples)
+
+    DirEntry.is_file/stat reuse the kernel readdir result where possible,
+    so no extra stat syscall is issued per file on Linux.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolder = f"{folder}/{entry.name}" if folder else entry.name
+                        subdirs.append((entry.path, subfolder))
+                    elif entry.is_file():
+                        # is_file() follows symlinks, so symlinked files are
+                        # inventoried like os.walk + stat did; for regular
+                        # files both calls reuse the cached readdir result
+                        if entry.name == CACHE_FILENAME:
+                            continue
+                        files.append((entry.path, folder, entry.name,
+                                      entry.stat()))
+                except OSError as e:
+                    print(f"Error processing {entry.path}: {e}", file=sys.stderr)
+    except OSError as e:
+        print(f"Error scanning {dir_path}: {e}", file=sys.stderr)
+    return files, subdirs
+
+
+def _walk_files(dir_path: str, folder: str = "") -> List[Tuple]:
+    """Walk a tree with scandir workers, returning file entry tuples
+
+    Tree traversal is metadata-bound — getdents plus a stat per entry —
+    and those syscalls serialize badly on network filesystems and cold
+    caches. Each worker lists one directory and feeds its subdirectories
+    back into the pool, so independent directories are listed in
+    parallel. Entry order is not guaranteed; callers group or sort as
+    needed.
+    """
+    results: List[Tuple] = []
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_scan_one_dir, dir_path, folder)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                results.extend(files)
+                for sub_path, sub_folder in subdirs:
+                    pending.add(executor.submit(_scan_one_dir, sub_path, sub_folder))
+    return results
+
+
+def _hash_file(file_path: str, folder: str, filename: str, st: os.stat_result, level: int,
+               verbose: bool, algorithm: str, sample_size: int,
+               cache: Optional[Dict[Tuple, Tuple]], seen: Optional[set]) -> Optional[FileRecord]:
+    """Build a FileRecord for a single file, hashing as required by level"""
+    relative_path = f"{folder}/{filename}" if folder else filename
+    try:
+        sample_hash = None
+        full_hash = None
+
+        cache_key = None
+        if cache is not None:
+            cache_key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+            # set.add is GIL-atomic; the rewrite keeps only keys seen here
+            seen.add(cache_key)
+            sample_hash, full_hash = cache.get(cache_key, (None, None))
+
+        hashed = False
+        if level >= 2 and sample_hash is None:
+            sample_hash = calculate_sample_hash(file_path, algorithm, sample_size, st.st_size)
+            hashed = True
+            if verbose:
+                print(f"  Sample hash: {relative_path}")
+
+        if level >= 3 and full_hash is None:
+            full_hash = calculate_full_hash(file_path, algorithm, st.st_size)
+            hashed = True
+            if verbose:
+                print(f"  Full hash: {relative_path}")
+
+        if cache is not None and hashed:
+            # dict assignment is atomic under the GIL, safe from pool threads
+            cache[cache_key] = (sample_hash, full_hash)
+
+        return FileRecord(folder, filename, st.st_size, sample_hash, full_hash)
+
+    except (OSError, IOError) as e:
+        print(f"Error processing {relative_path}: {e}", file=sys.stderr)
+        return None
+
+
+def scan_directory(source_dir, level: int, verbose: bool, algorithm: str = 'sha1',
+                   sample_size: int = DEFAULT_SAMPLE_SIZE, cache_file: Optional[str] = None):
+    """Scan directory, yielding FileRecord objects as they are produced"""
+    if verbose:
+        print(f"Scanning {source_dir} with level {level} identification...")
+
+    cache = None
+    foreign: List[Tuple] = []
+    seen: set = set()
+    if cache_file and level >= 2:
+        cache, foreign = _load_hash_cache(cache_file, algorithm, sample_size)
+        if verbose:
+            print(f"Loaded {len(cache)} hash cache entries from {cache_file}")
+
+    # Collect entries first (parallel, metadata-bound), then hash in
+    # parallel. hashlib releases the GIL inside its C update loop, so
+    # threads give real parallelism for the I/O + hashing work without
+    # the pickling cost of a process pool.
+    file_entries = _walk_files(str(source_dir))
+
+    # Level 2 is dominated by seek latency rather than hashing, so it
+    # tolerates heavier oversubscription than full-file hashing
+    workers = (os.cpu_count() or 1) * (4 if level <= 2 else 2)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in executor.map(lambda entry: _hash_file(*entry, level, verbose,
+                                                            algorithm, sample_size, cache, seen),
+                                   file_entries, chunksize=16):
+            if record is not None:
+                yield record
+
+    if cache is not None:
+        _write_hash_cache(cache_file, cache, algorithm, sample_size, seen, foreign)
+
+
+def _open_inventory_writer(output_file: Path):
+    """Open output_file for JSONL writing, returning (file, serialize)
+
+    serialize(dict) yields one complete line (newline included) in the
+    file's native type, so callers can feed a generator of lines to
+    f.writelines(). Uses orjson (C serializer, emits bytes) when
+    installed, the stdlib json module otherwise. A large write buffer
+    coalesces the per-line writes into few syscalls.
+    """
+    if orjson is not None:
+        f = open(output_file, 'wb', buffering=1 << 20)
+        # OPT_APPEND_NEWLINE makes orjson emit the trailing newline
+        # itself, skipping a bytes concatenation per record
+        return f, lambda d: orjson.dumps(d, option=orjson.OPT_APPEND_NEWLINE)
+
+    f = open(output_file, 'w', buffering=1 << 20)
+    return f, lambda d: json.dumps(d, separators=(',', ':')) + '\n'
+
+
+def read_inventory_header(inventory_file: Path) -> Dict[str, Any]:
+    """Read just the header line of an inventory file, if one is present"""
+    with open(inventory_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                return {}
+            return data if "filename" not in data else {}
+    return {}
+
+
+def load_inventory(inventory_file: Path) -> Iterator[FileRecord]:
+    """Yield FileRecords from a JSONL inventory file
+
+    Header metadata is read separately via read_inventory_header; header
+    lines encountered here are simply skipped.
+    """
+    # One bulk read plus a byte-level split beats Python-level line
+    # iteration; orjson parses each line in C when installed
+    loads = json.loads if orjson is None else orjson.loads
+    try:
+        with open(inventory_file, 'rb') as f:
+            data = f.read()
     except FileNotFoundError:
         print(f"Error: Inventory file {inventory_file} not found", file=sys.stderr)
         raise
     except IOError as e:
         print(f"Error reading inventory file: {e}", file=sys.stderr)
         raise
-    
-    return records
+
+    for line_num, line in enumerate(data.split(b'\n'), 1):
+        if not line.strip():
+            continue
+        try:
+            entry = loads(line)
+            if "filename" not in entry:
+                # Header line with inventory metadata (hash algorithm etc.)
+                continue
+            yield FileRecord(
+                folder=entry.get("folder", ""),
+                filename=entry["filename"],
+                size=entry["size"],
+                sample_hash=entry.get("sample_hash", entry.get("sample_sha1")),
+                full_hash=entry.get("full_hash", entry.get("full_sha1"))
+            )
+        except (ValueError, KeyError) as e:
+            print(f"Error parsing line {line_num} in inventory: {e}", file=sys.stderr)
+            continue
+
+
+def resolve_sample_hashes(inventory_records: List[FileRecord], target_records: List[FileRecord],
+                          target_dir, algorithm: str, sample_size: int, verbose: bool) -> None:
+    """Compute sample hashes only for target files that can match the inventory
+
+    A target file whose (filename, size) pair appears nowhere in the
+    inventory is extra no matter what it hashes to, so its hash is never
+    needed. In typical mirrors this prefilter skips most of the hashing
+    I/O for trees that have drifted apart.
+    """
+    candidates = {(r.filename, r.size) for r in inventory_records}
+    to_hash = [r for r in target_records if (r.filename, r.size) in candidates]
+
+    if verbose:
+        skipped = len(target_records) - len(to_hash)
+        print(f"Sample hashes: {skipped} ruled out by name+size, {len(to_hash)} to compute")
+
+    target_str = os.fspath(target_dir)
+
+    def hash_one(record: FileRecord) -> Optional[FileRecord]:
+        path = os.path.join(target_str, record.get_full_path())
+        try:
+            record.sample_hash = calculate_sample_hash(path, algorithm, sample_size, record.size)
+            if verbose:
+                print(f"  Sample hash: {record.get_full_path()}")
+            return None
+        except (OSError, IOError) as e:
+            print(f"Error processing {record.get_full_path()}: {e}", file=sys.stderr)
+            return record
+
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 4) as executor:
+            failed = {r for r in executor.map(hash_one, to_hash, chunksize=16) if r is not None}
+        if failed:
+            # A record we could not hash must not stay in the scan: with a
+            # None hash it matches nothing and would classify as a
+            # deletable extra. Dropping it mirrors how scan errors are
+            # handled at inventory time.
+            target_records[:] = [r for r in target_records if r not in failed]
+
+
+def resolve_full_hashes(inventory_records: List[FileRecord], target_records: List[FileRecord],
+                        target_dir, algorithm: str, verbose: bool) -> None:
+    """Fill in full hashes on target records scanned at sample level
+
+    When a target file's (filename, sample_hash) matches exactly one full
+    hash in the inventory, that hash is adopted without re-reading the
+    file — in the common mostly-unchanged mirror this skips the full-file
+    hashing for nearly every file. Only files whose sample is unknown to
+    the inventory, or ambiguous within it, are hashed in full.
+    """
+    inv_full_by_sample: Dict[Tuple, Optional[str]] = {}
+    for record in inventory_records:
+        if record.sample_hash and record.full_hash:
+            key = (record.filename, record.sample_hash)
+            known = inv_full_by_sample.setdefault(key, record.full_hash)
+            if known != record.full_hash:
+                inv_full_by_sample[key] = None  # ambiguous, needs real hashing
+
+    to_hash = []
+    for record in target_records:
+        if not record.sample_hash:
+            # The name+size prefilter already ruled out any inventory match
+            continue
+        full_hash = inv_full_by_sample.get((record.filename, record.sample_hash))
+        if full_hash:
+            record.full_hash = full_hash
+        else:
+            to_hash.append(record)
+
+    if verbose:
+        reused = len(target_records) - len(to_hash)
+        print(f"Full hashes: {reused} matched by sample, {len(to_hash)} to compute")
+
+    target_str = os.fspath(target_dir)
+
+    def hash_one(record: FileRecord) -> Optional[FileRecord]:
+        path = os.path.join(target_str, record.get_full_path())
+        try:
+            record.full_hash = calculate_full_hash(path, algorithm, record.size)
+            if verbose:
+                print(f"  Full hash: {record.get_full_path()}")
+            return None
+        except (OSError, IOError) as e:
+            print(f"Error processing {record.get_full_path()}: {e}", file=sys.stderr)
+            return record
+
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2) as executor:
+            failed = {r for r in executor.map(hash_one, to_hash, chunksize=16) if r is not None}
+        if failed:
+            # Same rule as the sample pass: an unhashable record would
+            # otherwise classify as a deletable extra, so drop it
+            target_records[:] = [r for r in target_records if r not in failed]
 
 
 def inventory_command(args):
@@ -167,19 +611,47 @@ def inventory_command(args):
         print(f"Creating inventory of {source_dir}")
         print(f"Output file: {output_file}")
         print(f"Identification level: {args.level}")
-    
-    # Scan directory
-    records = scan_directory(source_dir, args.level, args.verbose)
-    
-    # Write JSONL output
+        print(f"Hash algorithm: {args.hash}")
+
+    if not (0 < args.sample_size <= MAX_SAMPLE_SIZE):
+        print(f"Error: --sample-size must be between 1 and {MAX_SAMPLE_SIZE} bytes", file=sys.stderr)
+        return 1
+
+    if args.level >= 2:
+        # Fail before any scanning or output: a missing backend would
+        # otherwise raise inside pool workers mid-inventory
+        try:
+            new_hasher(args.hash)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        warn_if_sha1_unaccelerated(args.hash)
+
+    cache_file = os.path.join(str(source_dir), CACHE_FILENAME) if args.cache else None
+
+    # Scan directory and stream records straight to the output file, so
+    # memory stays O(1) regardless of tree size
     try:
-        with open(output_file, 'w') as f:
-            for record in records:
-                json.dump(record.to_dict(args.level), f, separators=(',', ':'))
-                f.write('\n')
-        
+        count = 0
+        f, serialize = _open_inventory_writer(output_file)
+        with f:
+            # writelines consumes the generator lazily, so this still
+            # streams; the buffered writer coalesces lines into large
+            # writes without a Python-level f.write call per record
+            def lines():
+                nonlocal count
+                if args.level >= 2:
+                    yield serialize({"dir_mimic": 1, "hash": args.hash,
+                                     "sample_size": args.sample_size})
+                for record in scan_directory(source_dir, args.level, args.verbose,
+                                             args.hash, args.sample_size, cache_file):
+                    yield serialize(record.to_dict(args.level))
+                    count += 1
+
+            f.writelines(lines())
+
         if args.verbose:
-            print(f"Inventory complete: {len(records)} files processed")
+            print(f"Inventory complete: {count} files processed")
             print(f"Output written to: {output_file}")
         
         return 0
@@ -189,39 +661,62 @@ def inventory_command(args):
         return 1
 
 
-def classify_files(inventory_records: List[FileRecord], target_records: List[FileRecord], 
-                  level: int) -> Tuple[List[Tuple], List[Tuple], List[FileRecord], List[FileRecord]]:
-    """Classify files as unchanged, need copying, missing, or extra"""
+def _identity_key_fn(level: int):
+    """Return a key function specialized for the level
+
+    Selecting the accessor once keeps per-record level branching out of
+    the million-iteration grouping loops. The level-2 key omits size
+    because the sample hash already encodes it as its prefix.
+    """
+    if level == 1:
+        return lambda r: (r.filename, r.size)
+    elif level == 2:
+        return lambda r: (r.filename, r.sample_hash)
+    elif level == 3:
+        return lambda r: (r.filename, r.size, r.full_hash)
+    else:
+        raise ValueError(f"Invalid level: {level}")
+
+
+def plan_operations(inventory_records: Iterable[FileRecord], target_records: Iterable[FileRecord],
+                    level: int, delete_extra: bool) -> Tuple[List[Tuple], List[Tuple], List[Tuple],
+                                                             List[FileRecord], List[FileRecord]]:
+    """Classify files and plan mv/cp/rm operations in a single pass
+
+    Records are grouped by identity once; each bucket directly yields its
+    unchanged pairs and, when --delete-extra allows it, pairs surplus
+    target copies with missing locations as moves instead of emitting a
+    copy plus a delete for the same content.
+
+    Returns (unchanged, mv_operations, cp_operations, missing, extra):
+    unchanged is [(inventory_record, target_record)], mv_operations is
+    [(source_path, target_path)], cp_operations is [(source_record,
+    target_path)], missing is inventory records with no target copy to
+    clone from, and extra is leftover target records — deleted downstream
+    when delete_extra is set, otherwise only reported.
+    """
     # Create identity mappings with lists to handle duplicates in both inventory and target
     inventory_by_identity = {}
     target_by_identity = {}
-    
+    identity_key = _identity_key_fn(level)
+
     for record in inventory_records:
-        key = record.get_identity_key(level)
-        if key not in inventory_by_identity:
-            inventory_by_identity[key] = []
-        inventory_by_identity[key].append(record)
-    
+        inventory_by_identity.setdefault(identity_key(record), []).append(record)
+
     for record in target_records:
-        key = record.get_identity_key(level)
-        if key not in target_by_identity:
-            target_by_identity[key] = []
-        target_by_identity[key].append(record)
-    
-    unchanged = []  # [(inventory_record, target_record)] - files in correct locations
-    to_copy = []    # [(source_record, target_path)] - files that need copying
-    missing = []    # [inventory_record] - files with no source in target to copy from
-    extra = []      # [target_record] - files in target not in inventory
-    
-    # Process each file identity
-    for identity_key in set(inventory_by_identity.keys()) | set(target_by_identity.keys()):
-        inv_records = inventory_by_identity.get(identity_key, [])
-        tgt_records = target_by_identity.get(identity_key, [])
-        
-        # Create sets of paths for easier comparison
-        inv_paths = {record.get_full_path() for record in inv_records}
-        tgt_paths = {record.get_full_path() for record in tgt_records}
-        
+        target_by_identity.setdefault(identity_key(record), []).append(record)
+
+    unchanged = []      # [(inventory_record, target_record)] - files in correct locations
+    mv_operations = []  # [(source_path, target_path)] - surplus copies moved into place
+    cp_operations = []  # [(source_record, target_path)] - files that need copying
+    missing = []        # [inventory_record] - files with no source in target to copy from
+    extra = []          # [target_record] - files in target not in inventory
+
+    # Process each file identity; dict views support set union directly
+    for key in inventory_by_identity.keys() | target_by_identity.keys():
+        inv_records = inventory_by_identity.get(key, [])
+        tgt_records = target_by_identity.get(key, [])
+
         if not inv_records:
             # Files exist in target but not in inventory - mark as extra
             extra.extend(tgt_records)
@@ -229,240 +724,165 @@ def classify_files(inventory_records: List[FileRecord], target_records: List[Fil
             # Files exist in inventory but not in target - mark as missing
             missing.extend(inv_records)
         else:
-            # Files exist in both - compare locations
-            
+            # Files exist in both - compare locations. Path->record dicts
+            # keep the per-bucket work linear even when one identity has
+            # many duplicates (think thousands of equal-sized files)
+            inv_by_path = {record.get_full_path(): record for record in inv_records}
+            tgt_by_path = {record.get_full_path(): record for record in tgt_records}
+
             # Find files already in correct locations (unchanged)
-            common_paths = inv_paths & tgt_paths
-            for path in common_paths:
-                # Find the records for this path
-                inv_record = next(r for r in inv_records if r.get_full_path() == path)
-                tgt_record = next(r for r in tgt_records if r.get_full_path() == path)
-                unchanged.append((inv_record, tgt_record))
-            
-            # Find inventory locations missing from target (need copying)
-            missing_paths = inv_paths - tgt_paths
-            if missing_paths and tgt_records:
-                # Use first target record as source for copying
-                source_record = tgt_records[0]  # Any target location can be the source
-                for path in missing_paths:
-                    to_copy.append((source_record, path))
-            elif missing_paths and not tgt_records:
-                # No target files to copy from - mark as missing
-                for path in missing_paths:
-                    inv_record = next(r for r in inv_records if r.get_full_path() == path)
-                    missing.append(inv_record)
-            
-            # Find target locations not in inventory (extra files)
-            extra_paths = tgt_paths - inv_paths
-            for path in extra_paths:
-                tgt_record = next(r for r in tgt_records if r.get_full_path() == path)
-                extra.append(tgt_record)
-    
-    return unchanged, to_copy, missing, extra
+            for path in inv_by_path.keys() & tgt_by_path.keys():
+                unchanged.append((inv_by_path[path], tgt_by_path[path]))
 
+            # Inventory locations with no file yet, and target copies with
+            # no matching inventory location
+            missing_paths = list(inv_by_path.keys() - tgt_by_path.keys())
+            surplus = [tgt_by_path[path] for path in tgt_by_path.keys() - inv_by_path.keys()]
 
-def optimize_commands(to_copy: List[Tuple], extra: List[FileRecord], level: int) -> Tuple[List[Tuple], List[Tuple], List[FileRecord]]:
-    """Optimize cp + rm operations into mv operations where possible"""
-    # Group operations by file identity
-    copy_by_identity = {}
-    delete_by_identity = {}
-    
-    # Group copy operations by file identity
-    for source_record, target_path in to_copy:
-        identity_key = source_record.get_identity_key(level)
-        if identity_key not in copy_by_identity:
-            copy_by_identity[identity_key] = []
-        copy_by_identity[identity_key].append((source_record.get_full_path(), target_path))
-    
-    # Group delete operations by file identity  
-    for record in extra:
-        identity_key = record.get_identity_key(level)
-        if identity_key not in delete_by_identity:
-            delete_by_identity[identity_key] = []
-        delete_by_identity[identity_key].append(record)
-    
-    mv_operations = []  # [(source_path, target_path)]
-    remaining_cp_operations = []  # [(source_record, target_path)]
-    remaining_rm_operations = []  # [FileRecord]
-    
-    # Process each file identity
-    all_identities = set(copy_by_identity.keys()) | set(delete_by_identity.keys())
-    
-    for identity_key in all_identities:
-        copy_ops = copy_by_identity.get(identity_key, [])
-        delete_records = delete_by_identity.get(identity_key, [])
-        delete_paths = [record.get_full_path() for record in delete_records]
-        
-        # Try to match copy targets with delete sources for mv operations
-        used_delete_indices = set()
-        remaining_copies = []
-        
-        for source_path, target_path in copy_ops:
-            # Try to find a delete path we can move from instead of copying
-            mv_created = False
-            for i, delete_path in enumerate(delete_paths):
-                if i not in used_delete_indices:
-                    # Use this delete path as source for move operation
-                    mv_operations.append((delete_path, target_path))
-                    used_delete_indices.add(i)
-                    mv_created = True
-                    break
-            
-            if not mv_created:
-                # No available delete path to move from, keep as copy
-                # Find the original source record for this copy
-                source_record = None
-                for orig_source_record, orig_target_path in to_copy:
-                    if (orig_source_record.get_full_path() == source_path and 
-                        orig_target_path == target_path):
-                        source_record = orig_source_record
-                        break
-                if source_record:
-                    remaining_cp_operations.append((source_record, target_path))
-        
-        # Add remaining delete operations that weren't used for moves
-        for i, record in enumerate(delete_records):
-            if i not in used_delete_indices:
-                remaining_rm_operations.append(record)
-    
-    return mv_operations, remaining_cp_operations, remaining_rm_operations
+            if delete_extra:
+                # Same content on both lists: move surplus copies into the
+                # missing locations instead of copy + delete
+                paired = min(len(missing_paths), len(surplus))
+                for i in range(paired):
+                    mv_operations.append((surplus[i].get_full_path(), missing_paths[i]))
+                missing_paths = missing_paths[paired:]
+                surplus = surplus[paired:]
 
+            # Remaining missing locations are filled by copying from any
+            # target record of this identity
+            source_record = tgt_records[0]
+            for path in missing_paths:
+                cp_operations.append((source_record, path))
 
-def generate_unix_commands(unchanged: List[Tuple], to_copy: List[Tuple], missing: List[FileRecord], 
-                          extra: List[FileRecord], target_dir: Path, verbose: bool, 
-                          delete_extra: bool, level: int) -> List[str]:
-    """Generate Unix commands for dry-run mode"""
+            extra.extend(surplus)
+
+    return unchanged, mv_operations, cp_operations, missing, extra
+
+
+def generate_unix_commands(unchanged: List[Tuple], mv_operations: List[Tuple],
+                          cp_operations: List[Tuple], missing: List[FileRecord],
+                          extra: List[FileRecord], target_dir: Path, verbose: bool,
+                          delete_extra: bool) -> List[str]:
+    """Generate Unix commands for dry-run mode
+
+    All paths pass through shlex.quote so the output is safe to feed to a
+    shell even when filenames contain spaces, quotes or metacharacters.
+    """
     commands = []
-    
+    quote = shlex.quote
+
+    # Emit each mkdir -p only once; many operations share a parent and
+    # repeated mkdir lines bloat the output and re-stat when executed
+    created_dirs = set()
+
+    def ensure_parent(target_path):
+        target_parent = os.path.dirname(target_path)
+        if target_parent and target_parent not in created_dirs:
+            commands.append(f"mkdir -p {quote(target_parent)}")
+            created_dirs.add(target_parent)
+
     # Generate echo commands for unchanged files (only if verbose)
     if verbose:
         for inv_record, tgt_record in unchanged:
-            commands.append(f"echo '{tgt_record.get_full_path()}' unchanged")
-    
-    # Optimize cp + rm operations into mv operations when possible
+            commands.append(f"echo {quote(tgt_record.get_full_path())} unchanged")
+
+    # Moves and copies are already paired up by plan_operations
+    for source_path, target_path in mv_operations:
+        ensure_parent(target_path)
+        commands.append(f"mv {quote(source_path)} {quote(target_path)}")
+
+    for source_record, target_path in cp_operations:
+        source_path = source_record.get_full_path()
+        ensure_parent(target_path)
+        commands.append(f"cp {quote(source_path)} {quote(target_path)}")
+
     if delete_extra:
-        mv_operations, remaining_cp_operations, remaining_rm_operations = optimize_commands(to_copy, extra, level)
-        
-        # Generate mv commands for optimized operations
-        for source_path, target_path in mv_operations:
-            # Add mkdir -p if target directory doesn't exist
-            target_parent = str(Path(target_path).parent)
-            if target_parent and target_parent != ".":
-                commands.append(f"mkdir -p '{target_parent}'")
-            
-            commands.append(f"mv '{source_path}' '{target_path}'")
-        
-        # Generate cp commands for remaining copy operations
-        for source_record, target_path in remaining_cp_operations:
-            source_path = source_record.get_full_path()
-            
-            # Add mkdir -p if target directory doesn't exist
-            target_parent = str(Path(target_path).parent)
-            if target_parent and target_parent != ".":
-                commands.append(f"mkdir -p '{target_parent}'")
-            
-            commands.append(f"cp '{source_path}' '{target_path}'")
-        
-        # Generate rm commands for remaining delete operations
-        for record in remaining_rm_operations:
-            commands.append(f"rm '{record.get_full_path()}'")
-    else:
-        # No delete operations, just generate cp commands
-        for source_record, target_path in to_copy:
-            source_path = source_record.get_full_path()
-            
-            # Add mkdir -p if target directory doesn't exist
-            target_parent = str(Path(target_path).parent)
-            if target_parent and target_parent != ".":
-                commands.append(f"mkdir -p '{target_parent}'")
-            
-            commands.append(f"cp '{source_path}' '{target_path}'")
-    
+        for record in extra:
+            commands.append(f"rm {quote(record.get_full_path())}")
+
     # Generate copy commands for missing files (placeholder - would need source dir)
     for record in missing:
         # This would require access to source directory - for now just comment
-        commands.append(f"# TODO: copy from source to '{record.get_full_path()}'")
-    
+        commands.append(f"# TODO: copy from source to {quote(record.get_full_path())}")
+
     return commands
 
 
-def execute_file_operations(unchanged: List[Tuple], to_copy: List[Tuple], missing: List[FileRecord], 
-                           extra: List[FileRecord], target_dir: Path, delete_extra: bool, 
-                           verbose: bool, level: int) -> bool:
+def _move_file(source_path: str, dest_path: str) -> None:
+    """Move via rename; fall back to copy+delete only across filesystems"""
+    try:
+        os.replace(source_path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, dest_path)
+
+
+def execute_file_operations(unchanged: List[Tuple], mv_operations: List[Tuple],
+                           cp_operations: List[Tuple], missing: List[FileRecord],
+                           extra: List[FileRecord], target_dir: Path, delete_extra: bool,
+                           verbose: bool) -> bool:
     """Execute actual file operations"""
     success = True
+    target_str = os.fspath(target_dir)
+
+    # Many operations land in the same directory; remember which parents
+    # have been created so mkdir is issued once per directory
+    created_dirs = set()
+
+    def ensure_parent(dest_path: str) -> None:
+        parent = os.path.dirname(dest_path)
+        if parent and parent not in created_dirs:
+            os.makedirs(parent, exist_ok=True)
+            created_dirs.add(parent)
     
-    # Optimize cp + rm operations into mv operations when possible
+    # Moves and copies are already paired up by plan_operations
+    for source_path, target_path in mv_operations:
+        source_full_path = os.path.join(target_str, source_path)
+        dest_full_path = os.path.join(target_str, target_path)
+
+        try:
+            # Create target directory if needed
+            ensure_parent(dest_full_path)
+
+            # Move file
+            _move_file(source_full_path, dest_full_path)
+
+            if verbose:
+                print(f"Moved: {source_path} -> {target_path}")
+
+        except (OSError, IOError) as e:
+            print(f"Error moving {source_full_path} to {dest_full_path}: {e}", file=sys.stderr)
+            success = False
+
+    for source_record, target_path in cp_operations:
+        source_path = os.path.join(target_str, source_record.get_full_path())
+        dest_path = os.path.join(target_str, target_path)
+
+        try:
+            # Create target directory if needed
+            ensure_parent(dest_path)
+
+            # Copy file
+            shutil.copy2(source_path, dest_path)
+
+            if verbose:
+                print(f"Copied: {source_record.get_full_path()} -> {target_path}")
+
+        except (OSError, IOError) as e:
+            print(f"Error copying {source_path} to {dest_path}: {e}", file=sys.stderr)
+            success = False
+
     if delete_extra:
-        mv_operations, remaining_cp_operations, remaining_rm_operations = optimize_commands(to_copy, extra, level)
-        
-        # Handle move operations
-        for source_path, target_path in mv_operations:
-            source_full_path = target_dir / source_path
-            dest_full_path = target_dir / target_path
-            
+        for record in extra:
+            file_path = os.path.join(target_str, record.get_full_path())
             try:
-                # Create target directory if needed
-                dest_full_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Move file
-                shutil.move(str(source_full_path), str(dest_full_path))
-                
-                if verbose:
-                    print(f"Moved: {source_path} -> {target_path}")
-            
-            except (OSError, IOError) as e:
-                print(f"Error moving {source_full_path} to {dest_full_path}: {e}", file=sys.stderr)
-                success = False
-        
-        # Handle remaining copy operations
-        for source_record, target_path in remaining_cp_operations:
-            source_path = target_dir / source_record.get_full_path()
-            dest_path = target_dir / target_path
-            
-            try:
-                # Create target directory if needed
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Copy file
-                shutil.copy2(str(source_path), str(dest_path))
-                
-                if verbose:
-                    print(f"Copied: {source_record.get_full_path()} -> {target_path}")
-            
-            except (OSError, IOError) as e:
-                print(f"Error copying {source_path} to {dest_path}: {e}", file=sys.stderr)
-                success = False
-        
-        # Handle remaining delete operations
-        for record in remaining_rm_operations:
-            file_path = target_dir / record.get_full_path()
-            try:
-                file_path.unlink()
+                os.remove(file_path)
                 if verbose:
                     print(f"Deleted: {record.get_full_path()}")
             except (OSError, IOError) as e:
                 print(f"Error deleting {file_path}: {e}", file=sys.stderr)
                 success = False
-    else:
-        # No delete operations, just handle copy operations
-        for source_record, target_path in to_copy:
-            source_path = target_dir / source_record.get_full_path()
-            dest_path = target_dir / target_path
-            
-            try:
-                # Create target directory if needed
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Copy file
-                shutil.copy2(str(source_path), str(dest_path))
-                
-                if verbose:
-                    print(f"Copied: {source_record.get_full_path()} -> {target_path}")
-            
-            except (OSError, IOError) as e:
-                print(f"Error copying {source_path} to {dest_path}: {e}", file=sys.stderr)
-                success = False
     
     # Handle missing files (would need source directory - placeholder)
     if missing and verbose:
@@ -490,29 +910,83 @@ def mirror_command(args):
         return 1
     
     try:
-        # Load inventory
+        # Peek at the header for the scan parameters, then load the full
+        # inventory on a worker thread while the target scan runs: the two
+        # phases touch different files, so their I/O can overlap
+        header = read_inventory_header(inventory_file)
+
+        # Inventories without a header predate the size-prefixed
+        # three-window sample hash: their sample hashes can never match
+        # ours, so a level-2 mirror would mismatch every file — and with
+        # --delete-extra, delete the whole target. Refuse rather than
+        # proceed with incomparable hashes. Level 3 is safe (full hashes
+        # compare fine); the sample shortcut just never fires.
+        if not header and args.level == 2:
+            print("Error: inventory has no header line and predates the current "
+                  "sample-hash format; its sample hashes are not comparable. "
+                  "Re-create the inventory or mirror with -L 1.", file=sys.stderr)
+            return 1
+        if not header and args.level >= 3:
+            print("Warning: inventory has no header line; sample hashes are not "
+                  "comparable, so matching candidates will be hashed in full.",
+                  file=sys.stderr)
+
+        # Determine hash algorithm: inventories without a header predate the
+        # header line and were always SHA-1
+        algorithm = header.get("hash", "sha1")
+        if args.hash and args.hash != algorithm:
+            print(f"Error: Inventory was created with {algorithm} hashes, "
+                  f"but --hash {args.hash} was requested", file=sys.stderr)
+            return 1
+
+        # Sample hashes only compare when taken with the same window width,
+        # so the target scan must use the inventory's sample size
+        sample_size = header.get("sample_size", DEFAULT_SAMPLE_SIZE)
+
+        if args.level >= 2:
+            try:
+                new_hasher(algorithm)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                return 1
+            warn_if_sha1_unaccelerated(algorithm)
+
         if args.verbose:
             print(f"Loading inventory from {inventory_file}")
-        inventory_records = load_inventory(inventory_file)
-        
-        if args.verbose:
-            print(f"Loaded {len(inventory_records)} files from inventory")
-        
-        # Scan target directory
-        if args.verbose:
             print(f"Scanning target directory {target_dir}")
-        target_records = scan_directory(target_dir, args.level, args.verbose)
-        
+
+        # Scan the target without hashing first; sample and full hashes are
+        # filled in afterwards, only where they can disambiguate a match
+        scan_level = min(args.level, 1)
+
+        # Generators only run when consumed, so the worker materializes the
+        # inventory; the hash resolvers below need multiple passes anyway
+        with ThreadPoolExecutor(max_workers=1) as loader:
+            inventory_future = loader.submit(lambda: list(load_inventory(inventory_file)))
+            target_records = list(scan_directory(target_dir, scan_level, args.verbose,
+                                                 algorithm, sample_size))
+            inventory_records = inventory_future.result()
+
+        if args.level >= 2:
+            resolve_sample_hashes(inventory_records, target_records, target_dir,
+                                  algorithm, sample_size, args.verbose)
+        if args.level >= 3:
+            resolve_full_hashes(inventory_records, target_records, target_dir,
+                                algorithm, args.verbose)
+
         if args.verbose:
+            print(f"Loaded {len(inventory_records)} files from inventory")
             print(f"Found {len(target_records)} files in target directory")
-        
-        # Classify files
-        unchanged, to_copy, missing, extra = classify_files(inventory_records, target_records, args.level)
-        
+
+        # Classify files and plan operations in one pass
+        unchanged, mv_operations, cp_operations, missing, extra = plan_operations(
+            inventory_records, target_records, args.level, args.delete_extra)
+
         # Print summary
         print(f"File analysis complete:")
         print(f"  Unchanged: {len(unchanged)}")
-        print(f"  To copy: {len(to_copy)}")
+        print(f"  To move: {len(mv_operations)}")
+        print(f"  To copy: {len(cp_operations)}")
         print(f"  Missing from target: {len(missing)}")
         print(f"  Extra in target: {len(extra)}")
         
@@ -521,8 +995,9 @@ def mirror_command(args):
             if args.verbose:
                 print("\nExecuting file operations...")
             
-            success = execute_file_operations(unchanged, to_copy, missing, extra, 
-                                            target_dir, args.delete_extra, args.verbose, args.level)
+            success = execute_file_operations(unchanged, mv_operations, cp_operations,
+                                            missing, extra, target_dir,
+                                            args.delete_extra, args.verbose)
             
             if not success:
                 print("Some operations failed", file=sys.stderr)
@@ -531,11 +1006,13 @@ def mirror_command(args):
             print("Mirror operation completed successfully")
         else:
             # Generate and print Unix commands (default dry-run)
-            commands = generate_unix_commands(unchanged, to_copy, missing, extra, 
-                                            target_dir, args.verbose, args.delete_extra, args.level)
+            commands = generate_unix_commands(unchanged, mv_operations, cp_operations,
+                                            missing, extra, target_dir,
+                                            args.verbose, args.delete_extra)
             if commands:
-                for command in commands:
-                    print(command)
+                # One join + one write instead of a syscall per command line
+                sys.stdout.write('\n'.join(commands))
+                sys.stdout.write('\n')
             else:
                 if args.verbose:
                     print("No actions needed.")
@@ -561,6 +1038,12 @@ def main():
     inventory_parser.add_argument('-o', '--output', help='Output inventory file')
     inventory_parser.add_argument('-L', '--level', type=int, choices=[1, 2, 3], default=1,
                                 help='Identification level (1=name+size, 2=+sample hash, 3=+full hash)')
+    inventory_parser.add_argument('--hash', choices=HASH_ALGORITHMS, default=default_hash_algorithm(),
+                                help='Hash algorithm for file identification (default: blake3 if installed, else sha1)')
+    inventory_parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                                help=f'Bytes per sample window for level 2 (default: {DEFAULT_SAMPLE_SIZE}, max: {MAX_SAMPLE_SIZE})')
+    inventory_parser.add_argument('--cache', action='store_true',
+                                help=f'Keep a {CACHE_FILENAME} sidecar in the source directory to skip re-hashing unchanged files')
     inventory_parser.add_argument('-v', '--verbose', action='store_true',
                                 help='Print progress messages')
     
@@ -570,6 +1053,8 @@ def main():
     mirror_parser.add_argument('--inventory', required=True, help='Inventory file to use')
     mirror_parser.add_argument('-L', '--level', type=int, choices=[1, 2, 3], default=1,
                              help='Identification level (must match inventory)')
+    mirror_parser.add_argument('--hash', choices=HASH_ALGORITHMS, default=None,
+                             help='Hash algorithm (default: taken from the inventory header)')
     mirror_parser.add_argument('--doit', action='store_true',
                              help='Actually perform file operations (default is dry-run)')
     mirror_parser.add_argument('--delete-extra', action='store_true',
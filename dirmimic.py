@@ -3,22 +3,61 @@ import os
 import json
 import hashlib
 import datetime
+import mmap
 import shutil
 from collections import defaultdict, namedtuple
 
-def calc_key(file_path, level):
+try:
+    import orjson  # optional C JSON codec; stdlib json is the fallback
+except ImportError:
+    orjson = None
+
+CACHE_FILENAME = ".dirmimic-cache.jsonl"
+
+# Identity key shared by inventory and mirror; hash fields default to None
+FileKey = namedtuple('FileKey', ['filename', 'size', 'sample_sha1', 'full_sha1'], defaults=(None, None))
+
+def _walk(top):
+    """Yield (rel_folder, entry) for every file under top via os.scandir.
+
+    DirEntry keeps the stat from the directory listing, so callers can
+    read the size without an extra stat syscall per file.
     """
-    Return a dict with keys for the given identification level:
-    Level 1: {"size", "filename"}
-    Level 2: {"size", "filename", "sample_sha1"}
-    Level 3: {"size", "filename", "full_sha1"}
+    stack = [(top, "")]
+    while stack:
+        path, rel_folder = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub = os.path.join(rel_folder, entry.name) if rel_folder else entry.name
+                        stack.append((entry.path, sub))
+                    elif entry.is_file():
+                        # follows symlinks, like the os.walk loop it replaced
+                        if entry.name == CACHE_FILENAME:
+                            continue
+                        yield rel_folder, entry
+        except OSError as e:
+            print(f"Error scanning {path}: {e}", file=sys.stderr)
+
+def calc_key(file_path, level, size=None):
+    """
+    Return a FileKey for the given identification level:
+    Level 1: filename + size
+    Level 2: + sample_sha1
+    Level 3: + full_sha1
     """
-    size = os.path.getsize(file_path)
+    if size is None:
+        size = os.path.getsize(file_path)
     filename = os.path.basename(file_path)
-    result = {"filename": filename, "size": size}
+    sample_sha1 = full_sha1 = None
+    have_fadvise = hasattr(os, 'posix_fadvise')
     if level == 2:
         h = hashlib.sha1()
         with open(file_path, 'rb') as f:
+            if have_fadvise:
+                # Only head and tail are read; readahead of the middle is wasted
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_RANDOM)
             if size <= 65536:
                 data = f.read()
                 h.update(data)
@@ -28,64 +67,161 @@ def calc_key(file_path, level):
                 last = f.read(65536)
                 h.update(first)
                 h.update(last)
-        result["sample_sha1"] = h.hexdigest()
+        sample_sha1 = h.hexdigest()
     elif level == 3:
         h = hashlib.sha1()
         with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(65536)
-                if not chunk:
-                    break
-                h.update(chunk)
-        result["full_sha1"] = h.hexdigest()
-    return result
+            if have_fadvise:
+                # Widen readahead for the sequential scan, then drop the
+                # pages: a full-tree hash pass reads each byte exactly once
+                # and should not evict everything else from the page cache
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            if size > 4 * 1024 * 1024:
+                # Large files: hash the mapping directly — no read syscalls,
+                # no copies into a user buffer, one update call end to end
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if hasattr(mm, 'madvise'):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    h.update(mm)
+            else:
+                # 1 MiB blocks: one syscall per ~16K SHA-1 blocks, and readinto
+                # reuses the buffer instead of allocating fresh bytes per chunk
+                buf = bytearray(1 << 20)
+                view = memoryview(buf)
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    h.update(view[:n])
+            if have_fadvise:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        full_sha1 = h.hexdigest()
+    return FileKey(filename, size, sample_sha1, full_sha1)
 
 def handle_inventory(args):
     source_dir = os.path.abspath(args.source_dir)
-    output = open(args.output, "w") if args.output else sys.stdout
     level = args.level
-    for root, dirs, files in os.walk(source_dir):
-        rel_folder = os.path.relpath(root, source_dir)
-        if rel_folder == ".":
-            rel_folder = ""
-        for fname in files:
-            fpath = os.path.join(root, fname)
-            entry = {"folder": rel_folder}
-            entry.update(calc_key(fpath, level))
-            print(json.dumps(entry), file=output)
-            if args.verbose:
-                print(f"Inventoried: {os.path.join(rel_folder, fname)}", file=sys.stderr)
+    if args.output and orjson is not None:
+        # orjson serializes in C and emits bytes; write the file in
+        # binary mode and let it append the newline itself
+        output = open(args.output, "wb")
+        dump = lambda e: output.write(orjson.dumps(e, option=orjson.OPT_APPEND_NEWLINE))
+    else:
+        output = open(args.output, "w") if args.output else sys.stdout
+        dump = lambda e: print(json.dumps(e), file=output)
+    for rel_folder, dirent in _walk(source_dir):
+        key = calc_key(dirent.path, level, dirent.stat().st_size)
+        entry = {"folder": rel_folder, "filename": key.filename, "size": key.size}
+        if key.sample_sha1:
+            entry["sample_sha1"] = key.sample_sha1
+        if key.full_sha1:
+            entry["full_sha1"] = key.full_sha1
+        dump(entry)
+        if args.verbose:
+            print(f"Inventoried: {os.path.join(rel_folder, dirent.name)}", file=sys.stderr)
     if args.output:
         output.close()
 
+def load_hash_cache(cache_path, level):
+    """Load {(rel_path, size, mtime_ns, ino): sha} for the given level.
+
+    Paths are relative to the target directory so the cache survives the
+    directory being referred to by different spellings. Entries for other
+    levels are returned separately so a rewrite can carry them forward
+    instead of a level-2 run erasing level-3 hashes and vice versa.
+    """
+    cache = {}
+    other_levels = []
+    try:
+        with open(cache_path, 'r') as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                    key = (e["path"], e["size"], e["mtime_ns"], e["ino"])
+                    if e.get("level") == level:
+                        cache[key] = e["sha"]
+                    else:
+                        other_levels.append((key, e))
+                except (ValueError, KeyError):
+                    continue
+    except OSError:
+        pass
+    return cache, other_levels
+
+def save_hash_cache(cache_path, cache, level, seen, other_levels):
+    """Rewrite the cache with entries whose file was seen this walk.
+
+    Keys not seen belong to deleted or renamed files and are dropped so
+    the sidecar does not grow without bound on a churning tree.
+    """
+    try:
+        with open(cache_path, 'w') as f:
+            for key, sha in cache.items():
+                if key not in seen:
+                    continue
+                path, size, mtime_ns, ino = key
+                json.dump({"path": path, "size": size, "mtime_ns": mtime_ns,
+                           "ino": ino, "level": level, "sha": sha}, f)
+                f.write('\n')
+            for key, e in other_levels:
+                if key in seen:
+                    json.dump(e, f)
+                    f.write('\n')
+    except OSError as e:
+        print(f"Warning: could not write hash cache: {e}", file=sys.stderr)
+
+def _fast_copy(src_path, dst_path):
+    """Copy a file, staying in the kernel where the platform allows.
+
+    os.copy_file_range skips the userspace bounce buffer and can reflink
+    on CoW filesystems; os.sendfile is the next best; plain
+    shutil.copyfile is the portable fallback. Metadata is carried over
+    afterwards, as shutil.copy2 did.
+    """
+    copied = False
+    if hasattr(os, 'copy_file_range') or hasattr(os, 'sendfile'):
+        with open(src_path, 'rb') as fsrc, open(dst_path, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            try:
+                while offset < size:
+                    if hasattr(os, 'copy_file_range'):
+                        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset)
+                    else:
+                        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                copied = offset >= size
+            except OSError:
+                # Not supported for this fd/filesystem combination;
+                # fall back to a plain userspace copy below
+                copied = False
+    if not copied:
+        shutil.copyfile(src_path, dst_path)
+    shutil.copystat(src_path, dst_path)
+
 def handle_mirror(args):
     # Handle the 'mirror' subcommand
     # args.target_dir, args.inventory, args.level, args.doit, args.delete_extra, args.verbose are available
     print(f"Mirroring to directory: {args.target_dir} from inventory: {args.inventory}")
-    
-    # Define a named tuple for file keys
-    FileKey = namedtuple('FileKey', ['filename', 'size', 'sample_sha1', 'full_sha1'], defaults=(None, None))
-    
+
     # key -> list(source_dirs)
     source_dirs = defaultdict(list)
     level = -1 # Will be set to the level inferred from the inventory file
 
-    # Read the inventory file
-    with open(args.inventory, 'r') as inv_file:
+    # Read the inventory file in binary; orjson parses each line in C
+    # when installed and tolerates the trailing newline without strip()
+    loads = json.loads if orjson is None else orjson.loads
+    with open(args.inventory, 'rb') as inv_file:
         for line in inv_file:
-            entry = json.loads(line.strip())
+            if not line.strip():
+                continue
+            entry = loads(line)
             
-            # Create a FileKey from the entry
-            key_fields = {
-                'filename': entry['filename'],
-                'size': entry['size']
-            }
-            if 'sample_sha1' in entry:
-                key_fields['sample_sha1'] = entry['sample_sha1']
-            if 'full_sha1' in entry:
-                key_fields['full_sha1'] = entry['full_sha1']
-            
-            key = FileKey(**key_fields)
+            # Fixed-order construction: no intermediate dict or **kwargs
+            key = FileKey(entry['filename'], entry['size'],
+                          entry.get('sample_sha1'), entry.get('full_sha1'))
             source_dirs[key].append(entry['folder'])
             
             if level == -1:
@@ -104,27 +240,56 @@ def handle_mirror(args):
 
     destination_dirs = defaultdict(list)
 
+    # Optional sidecar cache: files whose stat signature is unchanged
+    # since the previous run reuse their hash instead of re-reading
+    cache = None
+    other_levels = []
+    seen = set()
+    cache_path = os.path.join(args.target_dir, CACHE_FILENAME)
+    if getattr(args, 'cache', False) and level >= 2:
+        cache, other_levels = load_hash_cache(cache_path, level)
+        if args.verbose:
+            print(f"Loaded {len(cache)} hash cache entries", file=sys.stderr)
+
+    # Only target files whose (filename, size) also appears in the
+    # inventory can ever match a source entry; everything else is extra
+    # no matter what it hashes to, so hashing is reserved for candidates
+    candidates = {(k.filename, k.size) for k in source_dirs}
+
     # Walk the target directory and create keys for existing files
-    for root, _, files in os.walk(args.target_dir):
-        rel_folder = os.path.relpath(root, args.target_dir)
-        if rel_folder == ".":
-            rel_folder = ""
-        for fname in files:
-            fpath = os.path.join(root, fname)
-            key_dict = calc_key(fpath, level)
-            
-            # Create a FileKey from the key_dict
-            key_fields = {
-                'filename': key_dict['filename'],
-                'size': key_dict['size']
-            }
-            if 'sample_sha1' in key_dict:
-                key_fields['sample_sha1'] = key_dict['sample_sha1']
-            if 'full_sha1' in key_dict:
-                key_fields['full_sha1'] = key_dict['full_sha1']
-                
-            key = FileKey(**key_fields)
+    for rel_folder, dirent in _walk(args.target_dir):
+        st = dirent.stat()
+        cache_key = None
+        if cache is not None:
+            # Relative path, so the key is stable however target_dir is
+            # spelled; seen also covers unhashed files, keeping their
+            # entries alive across runs where the prefilter skips them
+            rel_path = os.path.join(rel_folder, dirent.name) if rel_folder else dirent.name
+            cache_key = (rel_path, st.st_size, st.st_mtime_ns, st.st_ino)
+            seen.add(cache_key)
+        if level == 1 or (dirent.name, st.st_size) not in candidates:
+            # Hashless key; at level 2/3 it can never equal an inventory
+            # key (those carry a hash), which is exactly right for extras
+            key = FileKey(dirent.name, st.st_size)
             destination_dirs[key].append(rel_folder)
+            continue
+        sha = cache.get(cache_key) if cache is not None else None
+        if sha is None:
+            key = calc_key(dirent.path, level, st.st_size)
+            if cache is not None:
+                new_sha = key.sample_sha1 or key.full_sha1
+                if new_sha:
+                    cache[cache_key] = new_sha
+        else:
+            key = FileKey(dirent.name, st.st_size,
+                          sha if level == 2 else None,
+                          sha if level == 3 else None)
+        destination_dirs[key].append(rel_folder)
+
+    # Written before any moves/deletes run: entries for files changed by
+    # this mirror get a new stat signature and simply miss next time
+    if cache is not None:
+        save_hash_cache(cache_path, cache, level, seen, other_levels)
 
     # Loop through combined keys from source and destination
     for key in set(source_dirs.keys()).union(destination_dirs.keys()):
@@ -160,7 +325,7 @@ def handle_mirror(args):
                     print(f"cp '{from_path}' to '{to_path}'", file=sys.stderr)
                     if args.doit:
                         os.makedirs(os.path.dirname(to_path), exist_ok=True)
-                        shutil.copy2(from_path, to_path)
+                        _fast_copy(from_path, to_path)
 
                 # The remaining are moves
                 moves_source_folders = only_source[num_to_copy:]
@@ -225,6 +390,8 @@ def main():
                              help='Actually perform file operations (default is dry-run)')
     mirror_parser.add_argument('--delete-extra', action='store_true',
                              help='Delete files in target that are not in inventory')
+    mirror_parser.add_argument('--cache', action='store_true',
+                             help='Cache target file hashes in the target directory between runs')
     mirror_parser.add_argument('-v', '--verbose', action='store_true',
                              help='Print detailed progress messages')
     